@@ -1,13 +1,43 @@
-import gradio as gr
 import os
-import tempfile
 import shutil
+
+# --- Gradio Cache Location ---
+# Output zips are written inside Gradio's cache so they are served in place rather
+# than hashed and copied. Put that cache on RAM-backed /dev/shm when it has room, to
+# skip disk IO (Docker's default /dev/shm is only 64 MB). Gradio reads
+# GRADIO_TEMP_DIR at import time, so this has to run before gradio is imported.
+SHM_MIN_FREE_BYTES = 2 * 1024 ** 3
+if ("GRADIO_TEMP_DIR" not in os.environ
+        and os.path.isdir("/dev/shm") and os.access("/dev/shm", os.W_OK)
+        and shutil.disk_usage("/dev/shm").free >= SHM_MIN_FREE_BYTES):
+    os.environ["GRADIO_TEMP_DIR"] = "/dev/shm/gradio"
+
+import gradio as gr
+from gradio.utils import get_upload_folder
+import asyncio
+import threading
+import atexit
+import tempfile
 import zipfile
 import traceback
-from langchain_community.document_loaders import TextLoader, DirectoryLoader
-from langchain.text_splitter import RecursiveCharacterTextSplitter
+import uuid
+import pickle
+import hashlib
+import json
+from collections import deque
+from itertools import accumulate
+from concurrent.futures import ThreadPoolExecutor
+import faiss
+import numpy as np
+from langchain_core.documents import Document
+import tiktoken
 from langchain_community.vectorstores import FAISS
+from langchain_community.docstore.in_memory import InMemoryDocstore
+from langchain_community.vectorstores.utils import DistanceStrategy
 from langchain_google_genai import GoogleGenerativeAIEmbeddings
+from langchain.embeddings import CacheBackedEmbeddings
+from langchain.storage import LocalFileStore
+from google.api_core.exceptions import ResourceExhausted
 from dotenv import load_dotenv
 
 # --- Configuration ---
@@ -24,8 +54,118 @@ if not google_api_key:
 GOOGLE_EMBEDDING_MODEL_NAME = "models/text-embedding-004" # <-- ADDED 'models/' PREFIX
 print(f"Using Google Embedding Model: {GOOGLE_EMBEDDING_MODEL_NAME}")
 
+# --- Embedding Batching ---
+# Number of chunks sent per embed_documents call. Keep this low enough to stay
+# under the per-minute token quota of the embedding API.
+EMBEDDING_BATCH_SIZE = 100
+# Maximum number of batches in flight at once.
+EMBEDDING_CONCURRENCY = 8
+# Retries (with exponential backoff) for a batch hitting the rate limit (HTTP 429).
+EMBEDDING_MAX_RETRIES = 5
+
+# --- Embedding Cache ---
+# Chunk embeddings are cached on disk, keyed by a hash of the chunk text, so
+# re-uploaded content is not sent to the embedding API again.
+EMBEDDING_CACHE_DIR = os.getenv("EMBEDDING_CACHE_DIR", "./emb_cache")
+
+# --- FAISS Index ---
+# faiss.index_factory description of the index to build. HNSW gives sublinear
+# search on large corpora, and SQ8 stores each dimension as an 8-bit integer
+# (4x smaller than float32). Use "HNSW32" to keep full-precision vectors, or
+# "Flat" for exact search.
+FAISS_INDEX_FACTORY = os.getenv("FAISS_INDEX_FACTORY", "HNSW32_SQ8")
+# Corpora with at least FAISS_COMPRESSED_MIN_CHUNKS chunks use a product-quantized
+# index instead, storing each vector in 64 bytes rather than 4 bytes per dimension.
+# IVF1024 needs roughly 40k training vectors, so keep the threshold above that.
+FAISS_COMPRESSED_INDEX_FACTORY = os.getenv("FAISS_COMPRESSED_INDEX_FACTORY", "OPQ64,IVF1024,PQ64")
+FAISS_COMPRESSED_MIN_CHUNKS = int(os.getenv("FAISS_COMPRESSED_MIN_CHUNKS", "50000"))
+# Vectors buffered to train an index before streaming the rest into it. SQ ranges need
+# a few thousand, 8-bit PQ codebooks about 39 x 256; IVF needs ~40 per inverted list.
+FAISS_MIN_TRAIN_SIZE = 10000
+FAISS_TRAIN_VECTORS_PER_LIST = 40
+# Inverted lists probed per query for IVF indexes (stored with the index)
+FAISS_IVF_NPROBE = 16
+print(f"Using FAISS index factory: {FAISS_INDEX_FACTORY} "
+      f"({FAISS_COMPRESSED_INDEX_FACTORY} from {FAISS_COMPRESSED_MIN_CHUNKS} chunks)")
+
+# --- Text Splitting ---
+# Chunk by tokens so chunk sizes track what the embedding model actually sees.
+# The tokenizer is loaded on first use (tiktoken may need to download it) and
+# cached by tiktoken afterwards.
+# Consider adjusting chunk size/overlap based on embedding model and content
+CHUNK_SIZE_TOKENS = 700
+CHUNK_OVERLAP_TOKENS = 100
+TOKENIZER_ENCODING = "cl100k_base"
+# Splitting is CPU-bound, but tiktoken's encoder releases the GIL, so larger uploads
+# are split on a shared thread pool. Below this much text a single thread is faster.
+SPLIT_PARALLEL_MIN_CHARS = 1_000_000
+split_executor = ThreadPoolExecutor(max_workers=os.cpu_count() or 1, thread_name_prefix="split")
+
+# --- File Loading ---
+# Number of uploaded files read in parallel.
+FILE_READ_WORKERS = 16
+
+# --- Request Handling ---
+# Processing mostly waits on the embedding API, so several requests can overlap.
+REQUEST_CONCURRENCY = 4
+# Maximum number of requests waiting in the Gradio queue.
+QUEUE_MAX_SIZE = 32
+
+# --- Output Location ---
+# One work root inside Gradio's cache for the life of the process; each browser
+# session reuses its own subdirectory, so requests don't create and remove temp
+# directories every time.
+GRADIO_CACHE_DIR = get_upload_folder()
+os.makedirs(GRADIO_CACHE_DIR, exist_ok=True)
+WORK_ROOT = tempfile.mkdtemp(prefix="embedding_generator_", dir=GRADIO_CACHE_DIR)
+atexit.register(shutil.rmtree, WORK_ROOT, ignore_errors=True)
+print(f"Writing index zip files to: {WORK_ROOT}")
+# Zips still being written; a new run in the same session removes every other zip there
+zips_in_progress = set()
+zips_in_progress_lock = threading.Lock()
+# Backstop for callers that never close a tab (API clients): Gradio checks its cache
+# every OUTPUT_CACHE_CHECK_SECONDS and deletes served zips older than OUTPUT_ZIP_MAX_AGE_SECONDS
+OUTPUT_CACHE_CHECK_SECONDS = 3600
+OUTPUT_ZIP_MAX_AGE_SECONDS = 24 * 3600
+
+# --- Embedding Cache Store ---
+class AtomicLocalFileStore(LocalFileStore):
+    """LocalFileStore that never leaves a partially written entry behind.
+
+    Each value is written to a temp file and renamed into place, so a crash or full disk
+    mid-write cannot leave a truncated entry. Entries that still fail to decode (e.g. from
+    an older cache) are treated as cache misses, so they are re-embedded and overwritten.
+    """
+
+    def mset(self, key_value_pairs):
+        for key, value in key_value_pairs:
+            full_path = self._get_full_path(key)
+            self._mkdir_for_store(full_path.parent)
+            tmp_fd, tmp_path = tempfile.mkstemp(dir=full_path.parent, prefix=".tmp_")
+            try:
+                with os.fdopen(tmp_fd, "wb") as f:
+                    f.write(value)
+                if self.chmod_file is not None:
+                    os.chmod(tmp_path, self.chmod_file)
+                os.replace(tmp_path, full_path)
+            except BaseException:
+                os.remove(tmp_path)
+                raise
+
+    def mget(self, keys):
+        values = super().mget(keys)
+        for i, value in enumerate(values):
+            if value is not None:
+                try:
+                    json.loads(value)
+                except ValueError:
+                    values[i] = None
+        return values
+
+
 # --- Initialize Embeddings ---
 embeddings = None
+cached_embeddings = None # Used for document embedding; embeddings stays the query embedder
 if google_api_key:
     try:
         embeddings = GoogleGenerativeAIEmbeddings(
@@ -35,17 +175,311 @@ if google_api_key:
             task_type="retrieval_document"
         )
         print(f"Google AI Embeddings ({GOOGLE_EMBEDDING_MODEL_NAME}) initialized successfully.")
+        cached_embeddings = CacheBackedEmbeddings.from_bytes_store(
+            embeddings,
+            AtomicLocalFileStore(EMBEDDING_CACHE_DIR),
+            namespace=GOOGLE_EMBEDDING_MODEL_NAME,
+            key_encoder="sha256",
+        )
+        print(f"Caching embeddings in: {EMBEDDING_CACHE_DIR}")
     except Exception as e:
         print(f"Error loading Google AI embeddings model '{GOOGLE_EMBEDDING_MODEL_NAME}': {e}")
         traceback.print_exc()
-        # embeddings remains None
+        embeddings = None
 else:
     print("ERROR: Cannot initialize Google Embeddings without GOOGLE_API_KEY.")
 
+# --- Embedding Event Loop ---
+# The async embedding client keeps a pooled gRPC (HTTP/2) channel tied to the event
+# loop it runs on. Running every request on one long-lived loop keeps that channel,
+# and its TLS session, alive across requests instead of reconnecting each time.
+embedding_loop = asyncio.new_event_loop()
+threading.Thread(target=embedding_loop.run_forever, name="embedding-loop", daemon=True).start()
+
 
 # --- Core Function ---
 
-def create_faiss_index_from_files(files_list):
+def _read_doc(file_obj):
+    """Reads one uploaded file into a Document, returning None if it cannot be read."""
+    # Handle potential path issues if file_obj.name includes directories
+    base_filename = os.path.basename(file_obj.name)
+    try:
+        with open(file_obj.name, encoding="utf-8", errors="replace") as f:
+            return Document(page_content=f.read(), metadata={"source": base_filename})
+    except Exception as e:
+        # Log errors but let the remaining files continue
+        print(f"Error reading file {file_obj.name}: {e}")
+        traceback.print_exc()
+        return None
+
+
+def _char_boundary(text_bytes, offset):
+    """Moves a UTF-8 byte offset forward to the start of the next character."""
+    while offset < len(text_bytes) and 0x80 <= text_bytes[offset] < 0xC0:
+        offset += 1
+    return offset
+
+
+def _split_one(document):
+    """Splits a single document into overlapping token windows (may run on split_executor).
+
+    Windows are sliced from the original text rather than decoded from token ids, so a
+    window edge falling inside a multi-byte character never produces U+FFFD.
+    """
+    tokenizer = tiktoken.get_encoding(TOKENIZER_ENCODING)
+    text_bytes = document.page_content.encode("utf-8")
+    token_ids = tokenizer.encode(document.page_content, disallowed_special=())
+    stride = CHUNK_SIZE_TOKENS - CHUNK_OVERLAP_TOKENS
+    # Stop once a window reaches the end, so no trailing window is contained in the previous one
+    windows = [
+        (i, min(i + CHUNK_SIZE_TOKENS, len(token_ids)))
+        for i in range(0, max(len(token_ids) - CHUNK_OVERLAP_TOKENS, 1), stride)
+    ]
+    # Byte offset of every window edge, from the byte length of the tokens between edges
+    edges = sorted({edge for window in windows for edge in window})
+    edge_lengths = (len(tokenizer.decode_bytes(token_ids[a:b])) for a, b in zip(edges, edges[1:]))
+    byte_offsets = dict(zip(edges, accumulate(edge_lengths, initial=0)))
+
+    chunks = []
+    for start, end in windows:
+        # Token edges can fall inside a multi-byte character; move them to the next character
+        text = text_bytes[_char_boundary(text_bytes, byte_offsets[start]):_char_boundary(text_bytes, byte_offsets[end])].decode("utf-8")
+        if text.strip():
+            chunks.append(Document(page_content=text, metadata=dict(document.metadata)))
+    return chunks
+
+
+async def _embed_batch(batch_texts):
+    """Embeds one batch of texts, retrying with exponential backoff when rate limited."""
+    for attempt in range(EMBEDDING_MAX_RETRIES + 1):
+        try:
+            return await cached_embeddings.aembed_documents(batch_texts)
+        except Exception as e:
+            # langchain_google_genai wraps API errors, so check the cause as well
+            rate_limited = isinstance(e, ResourceExhausted) or isinstance(e.__cause__, ResourceExhausted)
+            if not rate_limited or attempt == EMBEDDING_MAX_RETRIES:
+                raise
+            delay = 2 ** attempt
+            print(f"Rate limited while embedding a batch, retrying in {delay}s...")
+            await asyncio.sleep(delay)
+
+
+async def embed_batches(texts):
+    """Embeds texts in batches, yielding (start, vectors) per batch in order.
+
+    At most EMBEDDING_CONCURRENCY batches are scheduled ahead of the consumer, so later
+    batches keep embedding while earlier results are consumed, without finished results
+    piling up (e.g. when every batch is served from the embedding cache).
+    """
+    starts = iter(range(0, len(texts), EMBEDDING_BATCH_SIZE))
+    scheduled = deque()
+
+    def schedule_next():
+        start = next(starts, None)
+        if start is not None:
+            batch_texts = texts[start:start + EMBEDDING_BATCH_SIZE]
+            scheduled.append((start, asyncio.ensure_future(_embed_batch(batch_texts))))
+
+    try:
+        for _ in range(EMBEDDING_CONCURRENCY):
+            schedule_next()
+        while scheduled:
+            start, task = scheduled.popleft()
+            batch_vectors = await task
+            schedule_next()
+            yield start, batch_vectors
+    finally:
+        # Stop outstanding requests if the consumer fails or stops early
+        for _, task in scheduled:
+            task.cancel()
+
+
+def _iter_embedded_batches(texts):
+    """Drives embed_batches on the shared embedding loop from synchronous code."""
+    batches = embed_batches(texts)
+    try:
+        while True:
+            try:
+                yield asyncio.run_coroutine_threadsafe(batches.__anext__(), embedding_loop).result()
+            except StopAsyncIteration:
+                return
+    finally:
+        asyncio.run_coroutine_threadsafe(batches.aclose(), embedding_loop).result()
+
+
+def _create_index(dimension, num_vectors):
+    """Creates an empty FAISS index suited to the number of vectors it will hold."""
+    if num_vectors >= FAISS_COMPRESSED_MIN_CHUNKS:
+        factory = FAISS_COMPRESSED_INDEX_FACTORY
+    else:
+        factory = FAISS_INDEX_FACTORY
+    print(f"Building '{factory}' FAISS index for {num_vectors} vectors...")
+    # Vectors are unit length, so inner product ranks like cosine similarity with cheaper
+    # distance computations. Load with DistanceStrategy.MAX_INNER_PRODUCT.
+    index = faiss.index_factory(dimension, factory, faiss.METRIC_INNER_PRODUCT)
+    try:
+        faiss.extract_index_ivf(index).nprobe = FAISS_IVF_NPROBE
+    except RuntimeError:
+        pass # Not an IVF index
+    _cap_codebook_training(index)
+    return index
+
+
+def _cap_codebook_training(index):
+    """Caps OPQ rotation and PQ codebook training at about FAISS_MIN_TRAIN_SIZE vectors.
+
+    The training buffer is sized for the IVF quantizer, which still trains on all of it;
+    OPQ and PQ converge on far fewer points and are much slower per point.
+    """
+    index = faiss.downcast_index(index)
+    if isinstance(index, faiss.IndexPreTransform):
+        for i in range(index.chain.size()):
+            transform = faiss.downcast_VectorTransform(index.chain.at(i))
+            if isinstance(transform, faiss.OPQMatrix):
+                transform.max_train_points = FAISS_MIN_TRAIN_SIZE
+        index = faiss.downcast_index(index.index)
+    pq = getattr(index, "pq", None)
+    if pq is not None:
+        pq.cp.max_points_per_centroid = max(1, FAISS_MIN_TRAIN_SIZE // pq.ksub)
+
+
+def _training_size(index):
+    """Returns how many vectors an untrained index should be trained on."""
+    try:
+        nlist = faiss.extract_index_ivf(index).nlist
+    except RuntimeError:
+        nlist = 0 # Not an IVF index
+    return max(FAISS_MIN_TRAIN_SIZE, FAISS_TRAIN_VECTORS_PER_LIST * nlist)
+
+
+def _embed_into_vector_store(texts, metadatas):
+    """Embeds texts and adds each batch to the FAISS index as soon as it arrives.
+
+    Each batch is normalized, added and dropped. Indexes that need training (the SQ8
+    default, IVF/PQ) first buffer enough vectors to train on, as sized by
+    _training_size, then stream the rest. Corpora smaller than that training size
+    are therefore buffered in full before being added.
+    """
+    # Repeated boilerplate produces identical chunks; embed each distinct text once
+    unique_positions = {}
+    unique_texts = []
+    chunks_by_unique = [] # Chunk indexes sharing each unique text
+    for chunk_index, text in enumerate(texts):
+        text_hash = hashlib.blake2b(text.encode("utf-8"), digest_size=16).digest()
+        if text_hash not in unique_positions:
+            unique_positions[text_hash] = len(unique_texts)
+            unique_texts.append(text)
+            chunks_by_unique.append([])
+        chunks_by_unique[unique_positions[text_hash]].append(chunk_index)
+    # Embed in random order so the first batches, which train the index, are a
+    # representative sample rather than the first few files
+    order = np.random.default_rng(0).permutation(len(unique_texts))
+    unique_texts = [unique_texts[i] for i in order]
+    chunks_by_unique = [chunks_by_unique[i] for i in order]
+    print(f"Embedding {len(unique_texts)} unique chunks ({len(texts)} total)...")
+
+    index = None
+    row_chunks = [] # Chunk index for each row added to the index
+    pending_arrays = [] # Buffered until the index is trained
+    pending_chunks = []
+
+    for start, batch_vectors in _iter_embedded_batches(unique_texts):
+        batch_groups = chunks_by_unique[start:start + len(batch_vectors)]
+        # One contiguous float32 block per batch, with each vector repeated for its duplicate chunks
+        batch_array = np.repeat(
+            np.asarray(batch_vectors, dtype=np.float32),
+            [len(group) for group in batch_groups],
+            axis=0,
+        )
+        del batch_vectors
+        # Unit length vectors make inner product equal to cosine similarity
+        faiss.normalize_L2(batch_array)
+        batch_chunks = [chunk_index for group in batch_groups for chunk_index in group]
+
+        if index is None:
+            index = _create_index(batch_array.shape[1], len(texts))
+            train_size = min(_training_size(index), len(texts))
+
+        if index.is_trained:
+            index.add(batch_array)
+            row_chunks.extend(batch_chunks)
+        else:
+            pending_arrays.append(batch_array)
+            pending_chunks.extend(batch_chunks)
+            if len(pending_chunks) >= train_size:
+                train_array = np.concatenate(pending_arrays)
+                pending_arrays = []
+                print(f"Training FAISS index on {len(train_array)} vectors...")
+                index.train(train_array)
+                index.add(train_array)
+                row_chunks.extend(pending_chunks)
+                pending_chunks = []
+        print(f"Embedded {len(row_chunks) + len(pending_chunks)}/{len(texts)} chunks.")
+
+    docstore_ids = [str(uuid.uuid4()) for _ in texts]
+    docstore = InMemoryDocstore({
+        docstore_id: Document(page_content=text, metadata=metadata)
+        for docstore_id, text, metadata in zip(docstore_ids, texts, metadatas)
+    })
+    return FAISS(
+        embedding_function=embeddings,
+        index=index,
+        docstore=docstore,
+        index_to_docstore_id={row: docstore_ids[chunk_index] for row, chunk_index in enumerate(row_chunks)},
+        distance_strategy=DistanceStrategy.MAX_INNER_PRODUCT,
+    )
+
+
+def _session_dir_name(request):
+    """Returns a filesystem-safe directory name for the request's session."""
+    session_hash = request.session_hash if request is not None and request.session_hash else "default"
+    # session_hash is supplied by the client (e.g. ".."), so never use it as a path directly
+    return hashlib.sha256(session_hash.encode("utf-8")).hexdigest()
+
+
+def _session_work_dir(request):
+    """Returns the work directory for the request's session, creating it on first use."""
+    work_dir = os.path.join(WORK_ROOT, _session_dir_name(request))
+    os.makedirs(work_dir, exist_ok=True)
+    return work_dir
+
+
+def _new_session_zip(request):
+    """Creates an empty zip path for this run and removes the session's older zips."""
+    work_dir = _session_work_dir(request)
+    with zips_in_progress_lock:
+        # Only the latest result per session is kept; zips of runs still in progress are left alone
+        for name in os.listdir(work_dir):
+            stale_path = os.path.join(work_dir, name)
+            if stale_path not in zips_in_progress:
+                try:
+                    os.remove(stale_path)
+                except FileNotFoundError:
+                    pass
+        zip_fd, output_zip_path = tempfile.mkstemp(prefix="faiss_index_google_", suffix=".zip", dir=work_dir)
+        os.close(zip_fd)
+        zips_in_progress.add(output_zip_path)
+    return output_zip_path
+
+
+def cleanup_session_work_dir(request: gr.Request):
+    """Removes a session's work directory once its browser tab is closed."""
+    if request is not None and request.session_hash:
+        shutil.rmtree(os.path.join(WORK_ROOT, _session_dir_name(request)), ignore_errors=True)
+
+
+def _write_index_zip(output_zip_path, index, pkl_bytes):
+    """Writes index.faiss and index.pkl into a zip at output_zip_path."""
+    # FAISS index data is effectively incompressible, so store it without deflating
+    with zipfile.ZipFile(output_zip_path, 'w', compression=zipfile.ZIP_STORED) as zipf:
+        # faiss.write_index streams straight into the zip entry, so no full serialized copy
+        # of the index is held in memory. The size is unknown up front, so allow ZIP64.
+        with zipf.open("index.faiss", "w", force_zip64=True) as faiss_entry:
+            faiss.write_index(index, faiss.PyCallbackIOWriter(faiss_entry.write))
+        zipf.writestr("index.pkl", pkl_bytes)
+
+
+def create_faiss_index_from_files(files_list, request: gr.Request = None):
     """Loads, splits, embeds files, creates FAISS index, saves it, and returns a zip file path."""
     if embeddings is None:
         return "ERROR: Embeddings model could not be initialized. Check API key and logs.", None
@@ -53,110 +487,70 @@ def create_faiss_index_from_files(files_list):
         return "Please upload transcript files first.", None
 
     print(f"Processing {len(files_list)} files...")
-    temp_upload_dir = tempfile.TemporaryDirectory()
-    temp_index_dir = tempfile.mkdtemp() # Directory to save FAISS index
     output_zip_path = None
-    all_files_processed = True
-
-    # 1. Copy uploaded files to a temporary directory
-    for file_obj in files_list:
-        # Use the original filename from the Gradio File object if available
-        # Handle potential path issues if file_obj.name includes directories
-        base_filename = os.path.basename(file_obj.name)
-        temp_filepath = os.path.join(temp_upload_dir.name, base_filename)
-        try:
-            # Gradio file objects might be temp files already, shutil.copy is robust
-            shutil.copy(file_obj.name, temp_filepath)
-            print(f"Copied {base_filename} to {temp_filepath}")
-        except Exception as e:
-            print(f"Error copying file {file_obj.name}: {e}")
-            traceback.print_exc()
-            all_files_processed = False
-            # Continue processing other files if possible
-
-    if not all_files_processed:
-        temp_upload_dir.cleanup()
-        shutil.rmtree(temp_index_dir)
-        return "Error handling one or more uploaded files during copy.", None
 
     try:
-        # 2. Load documents from the temporary directory
-        loader = DirectoryLoader(
-            temp_upload_dir.name,
-            glob="**/*.txt",
-            loader_cls=TextLoader,
-            show_progress=True,
-            silent_errors=True, # Log errors but try to continue
-            use_multithreading=True # Speed up loading if many files
-        )
-        documents = loader.load()
+        # 1. Read uploaded files directly into documents, in parallel
+        with ThreadPoolExecutor(max_workers=FILE_READ_WORKERS) as executor:
+            documents = [doc for doc in executor.map(_read_doc, files_list) if doc is not None]
 
         if not documents:
-            temp_upload_dir.cleanup()
-            shutil.rmtree(temp_index_dir)
-            print("Warning: No documents loaded from the temporary directory.")
+            print("Warning: No documents loaded from the uploaded files.")
             return "Could not load any text from the uploaded files. Ensure they are valid .txt files.", None
 
         print(f"Loaded {len(documents)} documents.")
 
-        # 3. Split documents into chunks
-        # Consider adjusting chunk_size/overlap based on embedding model and content
-        text_splitter = RecursiveCharacterTextSplitter(chunk_size=800, chunk_overlap=180)
-        split_docs = text_splitter.split_documents(documents)
+        # 2. Split documents into chunks
+        if sum(len(document.page_content) for document in documents) >= SPLIT_PARALLEL_MIN_CHARS:
+            split_docs = [chunk for chunks in split_executor.map(_split_one, documents) for chunk in chunks]
+        else:
+            split_docs = [chunk for document in documents for chunk in _split_one(document)]
         print(f"Split into {len(split_docs)} chunks.")
 
         if not split_docs:
-            temp_upload_dir.cleanup()
-            shutil.rmtree(temp_index_dir)
             return "Error: No text chunks were generated after splitting the documents.", None
 
-        # 4. Create FAISS vector store
+        # 3. Create FAISS vector store
         print(f"Creating FAISS index using Google Embeddings ({GOOGLE_EMBEDDING_MODEL_NAME})...")
-        vector_store = FAISS.from_documents(split_docs, embeddings)
+        texts = [doc.page_content for doc in split_docs]
+        metadatas = [doc.metadata for doc in split_docs]
+        vector_store = _embed_into_vector_store(texts, metadatas)
         print("FAISS index created successfully.")
 
-        # 5. Save the FAISS index locally to the temp index directory
-        index_save_path = os.path.join(temp_index_dir, "faiss_index")
-        vector_store.save_local(index_save_path)
-        print(f"FAISS index saved to: {index_save_path}")
-
-        # Check if index files were created
-        expected_faiss_file = os.path.join(index_save_path, "index.faiss")
-        expected_pkl_file = os.path.join(index_save_path, "index.pkl")
-        if not os.path.exists(expected_faiss_file) or not os.path.exists(expected_pkl_file):
-             raise RuntimeError(f"FAISS index files not found at {index_save_path} after saving.")
-
-        # 6. Zip the saved index files
-        output_zip_filename = "faiss_index_google.zip"
-        # Create zip in a directory Gradio can access for output
-        # Using the same temp_index_dir might be okay, or create another temp file
-        output_zip_path = os.path.join(tempfile.gettempdir(), output_zip_filename) # Put zip in standard temp
-
-        with zipfile.ZipFile(output_zip_path, 'w') as zipf:
-            zipf.write(expected_faiss_file, arcname="index.faiss")
-            zipf.write(expected_pkl_file, arcname="index.pkl")
-        print(f"Created zip file: {output_zip_path}")
+        # 4. Serialize the index and zip it in one pass, without saving it to disk first
+        # Same layout FAISS.save_local writes, so FAISS.load_local can read it back
+        pkl_bytes = pickle.dumps((vector_store.docstore, vector_store.index_to_docstore_id))
 
-        # 7. Cleanup temporary directories
-        temp_upload_dir.cleanup()
-        shutil.rmtree(temp_index_dir) # Remove the directory where index was saved before zipping
+        # Create zip in Gradio's cache so it is served without another copy. Each run gets
+        # its own file, so concurrent runs in one session never write to or remove each other's zip
+        output_zip_path = _new_session_zip(request)
+        _write_index_zip(output_zip_path, vector_store.index, pkl_bytes)
+        print(f"Created zip file: {output_zip_path}")
 
         return f"Successfully processed {len(files_list)} file(s). Index saved and zipped.", output_zip_path
 
     except Exception as e:
         # Cleanup in case of error
-        temp_upload_dir.cleanup()
-        if os.path.exists(temp_index_dir):
-             shutil.rmtree(temp_index_dir)
-        if output_zip_path and os.path.exists(output_zip_path):
-             os.remove(output_zip_path) # Clean up partially created zip
+        if output_zip_path:
+            try:
+                os.remove(output_zip_path) # Clean up partially created zip
+            except FileNotFoundError:
+                pass
 
         print(f"Error during processing: {e}")
         traceback.print_exc()
         return f"An error occurred during processing: {str(e)}", None
 
+    finally:
+        if output_zip_path:
+            with zips_in_progress_lock:
+                zips_in_progress.discard(output_zip_path)
+
 # --- Gradio Interface Definition ---
-with gr.Blocks(theme=gr.themes.Soft()) as demo:
+with gr.Blocks(
+    theme=gr.themes.Soft(),
+    delete_cache=(OUTPUT_CACHE_CHECK_SECONDS, OUTPUT_ZIP_MAX_AGE_SECONDS)
+) as demo:
     gr.Markdown("# Document Embedding Generator 🧠💾")
     gr.Markdown(
         "Upload Whisper transcript `.txt` files. This tool will process them using Google Generative AI Embeddings "
@@ -182,8 +576,10 @@ with gr.Blocks(theme=gr.themes.Soft()) as demo:
     process_button.click(
         fn=create_faiss_index_from_files,
         inputs=[file_uploader],
-        outputs=[status_display, download_output]
+        outputs=[status_display, download_output],
+        concurrency_limit=REQUEST_CONCURRENCY
     )
+    demo.unload(cleanup_session_work_dir)
 
 # --- Launch the App ---
 if __name__ == "__main__":
@@ -193,5 +589,5 @@ if __name__ == "__main__":
     elif embeddings is None:
         print("ERROR: Google Embeddings failed to load during initial setup. Embedding generation will fail.")
 
-    demo.queue()
+    demo.queue(default_concurrency_limit=REQUEST_CONCURRENCY, max_size=QUEUE_MAX_SIZE)
     demo.launch()
\ No newline at end of file